@@ -16,12 +16,14 @@ from ocrd_utils import (
 )
 from ocrd_models.ocrd_page import (
     LabelsType, LabelType,
-    MetadataItemType
+    MetadataItemType,
+    PageType
 )
 from ocrd_modelfactory import page_from_file
 from ocrd import Processor
 
 from .config import OCRD_TOOL
+from .util import polygon_index
 
 TOOL = 'ocrd-segment-extract-pages'
 LOG = getLogger('processor.ExtractPages')
@@ -84,6 +86,11 @@ CLASSES = {
     'UnknownRegion':                        '646464FF',
     'CustomRegion':                         '637C81FF'}
 # pragma pylint: enable=bad-whitespace
+# region element classes (no subtypes) and their getters on the page:
+# (resolved once here instead of via getattr for every class on every page)
+REGION_GETTERS = tuple((name, getattr(PageType, 'get_' + name))
+                       for name in CLASSES
+                       if name and name != 'Border' and ':' not in name)
 
 class ExtractPages(Processor):
 
@@ -142,6 +149,7 @@ class ExtractPages(Processor):
         images = list()
         annotations = list()
         categories = list()
+        catids = dict() # category name -> first category id with that name
         i = 0
         for cat, color in CLASSES.items():
             # COCO format does not allow alpha channel
@@ -156,6 +164,7 @@ class ExtractPages(Processor):
             categories.append(
                 {'id': i, 'name': name, 'supercategory': supercat,
                  'source': 'PAGE', 'color': color})
+            catids.setdefault(name, i)
             i += 1
 
         i = 0
@@ -210,37 +219,25 @@ class ExtractPages(Processor):
                     raise
             page_image_dbg = Image.new(mode='RGBA', size=page_image.size,
                                        color='#' + CLASSES[''])
+            page_draw = ImageDraw.Draw(page_image_dbg)
             if page.get_Border():
                 polygon = coordinates_of_segment(
-                    page.get_Border(), page_image, page_coords).tolist()
-                ImageDraw.Draw(page_image_dbg).polygon(
-                    list(map(tuple, polygon)),
-                    fill='#' + CLASSES['Border'])
+                    page.get_Border(), page_image, page_coords)
+                # (flat coordinate sequence is the fastest path into PIL)
+                page_draw.polygon(polygon.ravel().tolist(),
+                                  fill='#' + CLASSES['Border'])
             else:
                 page_image_dbg.paste('#' + CLASSES['Border'],
                                      (0, 0, page_image.width, page_image.height))
-            regions = dict()
-            for name in CLASSES.keys():
-                if not name or name == 'Border' or ':' in name:
-                    # no subtypes here
-                    continue
-                regions[name] = getattr(page, 'get_' + name)()
+            regions = dict((name, getter(page)) for name, getter in REGION_GETTERS)
             description = {'angle': page.get_orientation()}
-            Neighbor = namedtuple('Neighbor', ['id', 'poly', 'type'])
+            Neighbor = namedtuple('Neighbor', ['region', 'type', 'polygon', 'poly'])
             neighbors = []
             for rtype, rlist in regions.items():
                 for region in rlist:
-                    if rtype in ['TextRegion', 'ChartRegion', 'GraphicRegion']:
-                        subrtype = region.get_type()
-                    else:
-                        subrtype = None
                     polygon = coordinates_of_segment(
                         region, page_image, page_coords)
-                    polygon2 = polygon.reshape(1, -1).tolist()
-                    polygon = polygon.tolist()
-                    xywh = xywh_from_polygon(polygon)
-                    # validate coordinates and check intersection with neighbours
-                    # (which would melt into another in the mask image):
+                    # validate coordinates
                     try:
                         poly = Polygon(polygon)
                         reason = ''
@@ -258,49 +255,61 @@ class ExtractPages(Processor):
                         LOG.error('Page "%s" region "%s" %s',
                                   page_id, region.id, reason)
                         continue
-                    poly_prep = prep(poly)
-                    for neighbor in neighbors:
-                        if (rtype == neighbor.type and
-                            poly_prep.intersects(neighbor.poly) and
-                            poly.intersection(neighbor.poly).area > 0):
+                    neighbors.append(Neighbor(region, rtype, polygon, poly))
+            # index all valid polygons spatially, so we only need to
+            # check pairs with intersecting bounding boxes
+            query = polygon_index([neighbor.poly for neighbor in neighbors])
+            for k, (region, rtype, polygon, poly) in enumerate(neighbors):
+                if rtype in ['TextRegion', 'ChartRegion', 'GraphicRegion']:
+                    subrtype = region.get_type()
+                else:
+                    subrtype = None
+                polygon2 = polygon.reshape(1, -1).tolist()
+                polygon = polygon.tolist()
+                xywh = xywh_from_polygon(polygon)
+                # check intersection with (preceding) neighbours
+                # (which would melt into another in the mask image):
+                poly_prep = prep(poly)
+                for neighbor in (neighbors[j] for j in query(poly) if j < k):
+                    if rtype == neighbor.type:
+                        if not poly_prep.intersects(neighbor.poly):
+                            continue
+                        # (clip only once, the area is needed for the IoU, too)
+                        inter_area = poly.intersection(neighbor.poly).area
+                        if inter_area > 0:
                             LOG.warning('Page "%s" region "%s" intersects neighbour "%s" (IoU: %.3f)',
-                                        page_id, region.id, neighbor.id,
-                                        poly.intersection(neighbor.poly).area / \
-                                        poly.union(neighbor.poly).area)
-                        elif (rtype != neighbor.type and
-                              poly_prep.within(neighbor.poly)):
-                            LOG.warning('Page "%s" region "%s" within neighbour "%s" (IoU: %.3f)',
-                                        page_id, region.id, neighbor.id,
-                                        poly.area / neighbor.poly.area)
-                    neighbors.append(Neighbor(region.id, poly, rtype))
-                    area = poly.area
-                    description.setdefault('regions', []).append(
-                        { 'type': rtype,
-                          'subtype': subrtype,
-                          'coords': polygon,
-                          'area': area,
-                          'features': page_coords['features'],
-                          'DPI': dpi,
-                          'region.ID': region.id,
-                          'page.ID': page_id,
-                          'page.type': ptype,
-                          'file_grp': self.input_file_grp,
-                          'METS.UID': self.workspace.mets.unique_identifier
-                        })
-                    # draw region:
-                    ImageDraw.Draw(page_image_dbg).polygon(
-                        list(map(tuple, polygon)),
-                        fill='#' + CLASSES[(rtype + ':' + subrtype) if subrtype else rtype])
-                    # COCO: add annotations
-                    i += 1
-                    annotations.append(
-                        {'id': i, 'image_id': num_page_id,
-                         'category_id': next((cat['id'] for cat in categories if cat['name'] == subrtype),
-                                             next((cat['id'] for cat in categories if cat['name'] == rtype))),
-                         'segmentation': polygon2,
-                         'area': area,
-                         'bbox': [xywh['x'], xywh['y'], xywh['w'], xywh['h']],
-                         'iscrowd': 0})
+                                        page_id, region.id, neighbor.region.id,
+                                        inter_area / poly.union(neighbor.poly).area)
+                    elif poly_prep.within(neighbor.poly):
+                        LOG.warning('Page "%s" region "%s" within neighbour "%s" (IoU: %.3f)',
+                                    page_id, region.id, neighbor.region.id,
+                                    poly.area / neighbor.poly.area)
+                area = poly.area
+                description.setdefault('regions', []).append(
+                    { 'type': rtype,
+                      'subtype': subrtype,
+                      'coords': polygon,
+                      'area': area,
+                      'features': page_coords['features'],
+                      'DPI': dpi,
+                      'region.ID': region.id,
+                      'page.ID': page_id,
+                      'page.type': ptype,
+                      'file_grp': self.input_file_grp,
+                      'METS.UID': self.workspace.mets.unique_identifier
+                    })
+                # draw region:
+                page_draw.polygon(polygon2[0],
+                                  fill='#' + CLASSES[(rtype + ':' + subrtype) if subrtype else rtype])
+                # COCO: add annotations
+                i += 1
+                annotations.append(
+                    {'id': i, 'image_id': num_page_id,
+                     'category_id': catids.get(subrtype, catids[rtype]),
+                     'segmentation': polygon2,
+                     'area': area,
+                     'bbox': [xywh['x'], xywh['y'], xywh['w'], xywh['h']],
+                     'iscrowd': 0})
             
             self.workspace.save_image_file(page_image_dbg,
                                            file_id + '.dbg',
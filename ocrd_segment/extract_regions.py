@@ -16,7 +16,7 @@ from ocrd_modelfactory import page_from_file
 from ocrd import Processor
 
 from .config import OCRD_TOOL
-from .extract_pages import CLASSES
+from .extract_pages import REGION_GETTERS
 
 TOOL = 'ocrd-segment-extract-regions'
 LOG = getLogger('processor.ExtractRegions')
@@ -94,12 +94,7 @@ class ExtractRegions(Processor):
                 dpi = None
             ptype = page.get_type()
 
-            regions = dict()
-            for name in CLASSES.keys():
-                if not name or name == 'Border' or ':' in name:
-                    # no subtypes here
-                    continue
-                regions[name] = getattr(page, 'get_' + name)()
+            regions = dict((name, getter(page)) for name, getter in REGION_GETTERS)
             for rtype, rlist in regions.items():
                 for region in rlist:
                     description = {'region.ID': region.id, 'region.type': rtype}
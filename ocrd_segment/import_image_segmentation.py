@@ -113,13 +113,13 @@ class ImportImageSegmentation(Processor):
                 colorformat = "#%06X"
                 if segmentation_pil.mode != 'RGB':
                     segmentation_pil = segmentation_pil.convert('RGB')
-            # convert to array
-            segmentation_array = np.array(segmentation_pil)
+            # convert to array (read-only view, no need for an extra copy)
+            segmentation_array = np.asarray(segmentation_pil)
             # collapse 3 color channels
             segmentation_array = segmentation_array.dot(
                 np.array([2**24, 2**16, 2**8, 1], np.uint32)[0 if has_alpha else 1:])
             # partition mapped colors vs background
-            colors = np.unique(segmentation_array)
+            colors, counts = np.unique(segmentation_array, return_counts=True)
             bgcolors = []
             for i, color in enumerate(colors):
                 colorname = colorformat % color
@@ -128,14 +128,15 @@ class ImportImageSegmentation(Processor):
                     #raise Exception("Unknown color %s (not in colordict)" % colorname)
                     LOG.info("Ignoring background color %s", colorname)
                     bgcolors.append(i)
-            background = np.zeros_like(segmentation_array, np.uint8)
+            # mark all background colors in a single pass
+            background = np.isin(segmentation_array, colors[bgcolors]).view(np.uint8)
             if bgcolors:
-                for i in bgcolors:
-                    background += np.array(segmentation_array == colors[i], np.uint8)
                 colors = np.delete(colors, bgcolors, 0)
+                counts = np.delete(counts, bgcolors, 0)
+            total_area = segmentation_array.size
             # iterate over mask for each mapped color/class
             regionno = 0
-            for color in colors:
+            for color, count in zip(colors, counts):
                 # get region (sub)type
                 colorname = colorformat % color
                 classname = colordict[colorname]
@@ -157,10 +158,12 @@ class ImportImageSegmentation(Processor):
                 if classtype is BorderType:
                     # mask from all non-background regions
                     classmask = 1 - background
+                    count = np.sum(counts)
                 else:
                     # mask from current color/class
-                    classmask = np.array(segmentation_array == color, np.uint8)
-                if not np.count_nonzero(classmask):
+                    # (reinterpret bool as uint8 in-place, no need to cast)
+                    classmask = (segmentation_array == color).view(np.uint8)
+                if not count:
                     continue
                 # now get the contours and make polygons for them
                 contours, _ = cv2.findContours(classmask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -168,7 +171,7 @@ class ImportImageSegmentation(Processor):
                     # (could also just take bounding boxes to avoid islands/inclusions...)
                     area = cv2.contourArea(contour)
                     # filter too small regions
-                    area_pct = area / np.prod(segmentation_array.shape) * 100
+                    area_pct = area / total_area * 100
                     if area < 100 and area_pct < 0.1:
                         LOG.warning('ignoring contour of only %.1f%% area for %s',
                                     area_pct, classname)
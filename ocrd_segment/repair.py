@@ -1,12 +1,19 @@
 from __future__ import absolute_import
 
 import os.path
-from collections import namedtuple
-from skimage import draw
-from scipy.ndimage import filters, morphology
+import multiprocessing
+from collections import namedtuple, deque
+from concurrent.futures import ProcessPoolExecutor, Future
 import cv2
 import numpy as np
 from shapely.geometry import Polygon, LineString
+from shapely.prepared import prep
+from shapely.ops import unary_union
+try:
+    # vectorized geometry construction (Shapely >= 2.0)
+    from shapely import linearrings, polygons, get_coordinates
+except ImportError:
+    linearrings = polygons = get_coordinates = None
 
 from ocrd import Processor
 from ocrd_utils import (
@@ -14,7 +21,6 @@ from ocrd_utils import (
     coordinates_for_segment,
     coordinates_of_segment,
     polygon_from_points,
-    points_from_polygon,
     xywh_from_polygon,
     MIMETYPE_PAGE
 )
@@ -32,9 +38,11 @@ from ocrd_models.ocrd_page_generateds import (
     OrderedGroupIndexedType,
     UnorderedGroupType,
     UnorderedGroupIndexedType,
-    ReadingOrderType
+    ReadingOrderType,
+    parseString
 )
 from .config import OCRD_TOOL
+from .util import polygon_index, points_from_array
 
 TOOL = 'ocrd-segment-repair'
 LOG = getLogger('processor.RepairSegmentation')
@@ -55,134 +63,210 @@ class RepairSegmentation(Processor):
         
         Return information on the plausibility of the segmentation into
         regions on the logging level.
+        
+        If ``num_workers`` is not 1, then repair multiple pages concurrently
+        in separate processes.
         """
         sanitize = self.parameter['sanitize']
-        plausibilize = self.parameter['plausibilize']
+        # (resolve GPU availability only once, not for each page;
+        #  the GPU is only used for sanitizing)
+        parameter = dict(self.parameter)
+        parameter['use_gpu'] = sanitize and parameter['use_gpu']
+        if parameter['use_gpu'] and not _cuda_available():
+            LOG.warning('No CUDA device available for OpenCV, sanitizing on CPU')
+            parameter['use_gpu'] = False
+        num_workers = self.parameter['num_workers'] or os.cpu_count()
+        if num_workers > 1:
+            # repair pages in separate processes, but keep all workspace
+            # access (reading input files and adding output files) here:
+            if parameter['use_gpu']:
+                # CUDA is already initialized here (by the probe above),
+                # and cannot be used in forked children, so spawn them:
+                mp_context = multiprocessing.get_context('spawn')
+            else:
+                mp_context = None
+            pool = ProcessPoolExecutor(max_workers=num_workers, mp_context=mp_context)
+        else:
+            pool = None
+        pending = deque() # pages submitted to the pool, in input order
+        
+        try:
+            for (n, input_file) in enumerate(self.input_files):
+                page_id = input_file.pageId or input_file.ID
+                LOG.info("INPUT FILE %i / %s", n, page_id)
+                pcgts = page_from_file(self.workspace.download_file(input_file))
+                page = pcgts.get_Page()
+                metadata = pcgts.get_Metadata() # ensured by from_file()
+                metadata.add_MetadataItem(
+                    MetadataItemType(type_="processingStep",
+                                     name=self.ocrd_tool['steps'][0],
+                                     value=TOOL,
+                                     Labels=[LabelsType(
+                                         externalModel="ocrd-tool",
+                                         externalId="parameters",
+                                         Label=[LabelType(type_=name,
+                                                          value=self.parameter[name])
+                                                for name in self.parameter.keys()])]))
+
+                if sanitize:
+                    page_image, page_coords, _ = self.workspace.image_from_page(
+                        page, page_id)
+                else:
+                    page_image, page_coords = None, None
+
+                if pool:
+                    pending.append((n, input_file, pool.submit(
+                        _repair_page_xml, to_xml(pcgts), page_id,
+                        page_image, page_coords, parameter)))
+                    # do not keep more pages in memory than needed to keep workers busy:
+                    while len(pending) > 2 * num_workers:
+                        self.add_page_file(*pending.popleft())
+                else:
+                    _repair_page(page, page_id, page_image, page_coords, parameter)
+                    self.add_page_file(n, input_file, to_xml(pcgts))
+            
+            while pending:
+                self.add_page_file(*pending.popleft())
+        finally:
+            if pool:
+                # (if any page failed, do not wait for those still queued)
+                for _, _, result in pending:
+                    result.cancel()
+                pool.shutdown()
+    
+    def add_page_file(self, n, input_file, content):
+        """Add the serialized PAGE ``content`` for the ``n``-th ``input_file`` to the workspace.
         
-        for (n, input_file) in enumerate(self.input_files):
-            page_id = input_file.pageId or input_file.ID
-            LOG.info("INPUT FILE %i / %s", n, page_id)
-            pcgts = page_from_file(self.workspace.download_file(input_file))
-            page = pcgts.get_Page()
-            metadata = pcgts.get_Metadata() # ensured by from_file()
-            metadata.add_MetadataItem(
-                MetadataItemType(type_="processingStep",
-                                 name=self.ocrd_tool['steps'][0],
-                                 value=TOOL,
-                                 Labels=[LabelsType(
-                                     externalModel="ocrd-tool",
-                                     externalId="parameters",
-                                     Label=[LabelType(type_=name,
-                                                      value=self.parameter[name])
-                                            for name in self.parameter.keys()])]))
-
-            #
-            # validate segmentation (warn of children extending beyond their parents)
-            #
-            self.validate_coords(page, page_id)
-
-            #
-            # sanitize region segmentation (shrink to hull of lines)
-            #
-            if sanitize:
-                self.sanitize_page(page, page_id)
+        (``content`` may also be the pending result of a worker process.)
+        """
+        if isinstance(content, Future):
+            content = content.result()
+        # Use input_file's basename for the new file -
+        # this way the files retain the same basenames:
+        file_id = input_file.ID.replace(self.input_file_grp, self.output_file_grp)
+        if file_id == input_file.ID:
+            file_id = concat_padded(self.output_file_grp, n)
+        self.workspace.add_file(
+            ID=file_id,
+            file_grp=self.output_file_grp,
+            pageId=input_file.pageId,
+            mimetype=MIMETYPE_PAGE,
+            local_filename=os.path.join(self.output_file_grp,
+                                        file_id + '.xml'),
+            content=content)
+    
+    @staticmethod
+    def plausibilize_page(page, page_id, plausibilize, min_overlap):
+        """Find (and, if ``plausibilize``, remove or merge) redundant text regions."""
+        mark_for_deletion = set() # what regions get removed?
+        mark_for_merging = dict() # what regions get merged into which regions?
+
+        # TODO: cover recursive region structure (but compare only at the same level)
+        regions = page.get_TextRegion()
+        # sort by area to ensure to arrive at a total ordering compatible
+        # with the topological sort along containment/equivalence arcs
+        # (so we can avoid substituting regions with superregions that have
+        #  themselves been substituted/deleted):
+        RegionPolygon = namedtuple('RegionPolygon', ['region', 'polygon'])
+        polys = _segment_polygons(regions)
+        # (get each area only once, and keep it for the comparisons below)
+        areas = _polygon_areas(polys)
+        order = np.argsort(areas, kind='stable')
+        regionspolys = [RegionPolygon(regions[k], polys[k]) for k in order]
+        areas = areas[order].tolist()
+        # index polygons spatially, so we only need to compare
+        # pairs with intersecting bounding boxes:
+        query = polygon_index([regionpoly.polygon for regionpoly in regionspolys])
+        bounds = [regionpoly.polygon.bounds for regionpoly in regionspolys]
+        for i in range(0, len(regionspolys)):
+            candidates = [j for j in query(regionspolys[i].polygon) if j > i]
+            if not candidates:
+                continue
+            # prepare once for all comparisons with this region:
+            poly1_prep = _prep_valid(regionspolys[i].polygon)
+            for j in candidates:
+                region1 = regionspolys[i].region
+                region2 = regionspolys[j].region
+                poly1 = regionspolys[i].polygon
+                poly2 = regionspolys[j].polygon
+                bounds1 = bounds[i]
+                bounds2 = bounds[j]
+                area1 = areas[i]
+                area2 = areas[j]
+                LOG.debug('Comparing regions "%s" and "%s"', region1.id, region2.id)
                 
-            #
-            # plausibilize region segmentation (remove redundant text regions)
-            #
-            mark_for_deletion = list() # what regions get removed?
-            mark_for_merging = dict() # what regions get merged into which regions?
-
-            # TODO: cover recursive region structure (but compare only at the same level)
-            regions = page.get_TextRegion()
-            # sort by area to ensure to arrive at a total ordering compatible
-            # with the topological sort along containment/equivalence arcs
-            # (so we can avoid substituting regions with superregions that have
-            #  themselves been substituted/deleted):
-            RegionPolygon = namedtuple('RegionPolygon', ['region', 'polygon'])
-            regionspolys = sorted([RegionPolygon(region, Polygon(polygon_from_points(region.get_Coords().points)))
-                                   for region in regions],
-                                  key=lambda x: x.polygon.area)
-            for i in range(0, len(regionspolys)):
-                for j in range(i+1, len(regionspolys)):
-                    region1 = regionspolys[i].region
-                    region2 = regionspolys[j].region
-                    poly1 = regionspolys[i].polygon
-                    poly2 = regionspolys[j].polygon
-                    LOG.debug('Comparing regions "%s" and "%s"', region1.id, region2.id)
-                    
-                    if poly1.almost_equals(poly2):
-                        LOG.warning('Page "%s" region "%s" is almost equal to "%s" %s',
+                # (pretest bounding boxes before each of the GEOS predicates:
+                #  almost equal polygons have almost equal bounding boxes,
+                #  and a polygon can only contain another if its bbox does)
+                if (_bbox_almost_equal(bounds1, bounds2) and
+                    poly1.almost_equals(poly2)):
+                    LOG.warning('Page "%s" region "%s" is almost equal to "%s" %s',
+                                page_id, region2.id, region1.id,
+                                '(removing)' if plausibilize else '')
+                    mark_for_deletion.add(region2.id)
+                elif (_bbox_within(bounds2, bounds1) and
+                      _within(poly2, poly1, poly1_prep)):
+                    LOG.warning('Page "%s" region "%s" is within "%s" %s',
+                                page_id, region2.id, region1.id,
+                                '(removing)' if plausibilize else '')
+                    mark_for_deletion.add(region2.id)
+                elif (_bbox_within(bounds1, bounds2) and
+                      poly2.contains(poly1)):
+                    LOG.warning('Page "%s" region "%s" is within "%s" %s',
+                                page_id, region1.id, region2.id,
+                                '(removing)' if plausibilize else '')
+                    mark_for_deletion.add(region1.id)
+                elif (poly1_prep or poly1).overlaps(poly2):
+                    # the bounding boxes' intersection is a cheap upper bound
+                    # of the intersection area -- if that is too small already,
+                    # neither region can be merged, so avoid clipping them:
+                    if (_bbox_intersection_area(bounds1, bounds2) <=
+                        min_overlap * min(area1, area2)):
+                        continue
+                    inter_poly = poly1.intersection(poly2)
+                    union_poly = poly1.union(poly2)
+                    LOG.debug('Page "%s" region "%s" overlaps "%s" by %f/%f',
+                              page_id, region1.id, region2.id, inter_poly.area/area1, inter_poly.area/area2)
+                    if union_poly.convex_hull.area >= area1 + area2:
+                        # skip this pair -- combined polygon encloses previously free segments
+                        pass
+                    elif inter_poly.area / area2 > min_overlap:
+                        LOG.warning('Page "%s" region "%s" is almost within "%s" %s',
                                     page_id, region2.id, region1.id,
-                                    '(removing)' if plausibilize else '')
-                        mark_for_deletion.append(region2.id)
-                    elif poly1.contains(poly2):
-                        LOG.warning('Page "%s" region "%s" is within "%s" %s',
-                                    page_id, region2.id, region1.id,
-                                    '(removing)' if plausibilize else '')
-                        mark_for_deletion.append(region2.id)
-                    elif poly2.contains(poly1):
-                        LOG.warning('Page "%s" region "%s" is within "%s" %s',
+                                    '(merging)' if plausibilize else '')
+                        mark_for_merging[region2.id] = region1
+                    elif inter_poly.area / area1 > min_overlap:
+                        LOG.warning('Page "%s" region "%s" is almost within "%s" %s',
                                     page_id, region1.id, region2.id,
-                                    '(removing)' if plausibilize else '')
-                        mark_for_deletion.append(region1.id)
-                    elif poly1.overlaps(poly2):
-                        inter_poly = poly1.intersection(poly2)
-                        union_poly = poly1.union(poly2)
-                        LOG.debug('Page "%s" region "%s" overlaps "%s" by %f/%f',
-                                  page_id, region1.id, region2.id, inter_poly.area/poly1.area, inter_poly.area/poly2.area)
-                        if union_poly.convex_hull.area >= poly1.area + poly2.area:
-                            # skip this pair -- combined polygon encloses previously free segments
-                            pass
-                        elif inter_poly.area / poly2.area > self.parameter['plausibilize_merge_min_overlap']:
-                            LOG.warning('Page "%s" region "%s" is almost within "%s" %s',
-                                        page_id, region2.id, region1.id,
-                                        '(merging)' if plausibilize else '')
-                            mark_for_merging[region2.id] = region1
-                        elif inter_poly.area / poly1.area > self.parameter['plausibilize_merge_min_overlap']:
-                            LOG.warning('Page "%s" region "%s" is almost within "%s" %s',
-                                        page_id, region1.id, region2.id,
-                                        '(merging)' if plausibilize else '')
-                            mark_for_merging[region1.id] = region2
-
-                    # TODO: more merging cases...
-                    #LOG.info('Intersection %i', poly1.intersects(poly2))
-                    #LOG.info('Containment %i', poly1.contains(poly2))
-                    #if poly1.intersects(poly2):
-                    #    LOG.info('Area 1 %d', poly1.area)
-                    #    LOG.info('Area 2 %d', poly2.area)
-                    #    LOG.info('Area intersect %d', poly1.intersection(poly2).area)
-                        
-
-            if plausibilize:
-                # the reading order does not have to include all regions
-                # but it may include all types of regions!
-                ro = page.get_ReadingOrder()
-                if ro:
-                    rogroup = ro.get_OrderedGroup() or ro.get_UnorderedGroup()
-                else:
-                    rogroup = None
-                # pass the regions sorted (see above)
-                _plausibilize_group(regionspolys, rogroup, mark_for_deletion, mark_for_merging)
-
-            # Use input_file's basename for the new file -
-            # this way the files retain the same basenames:
-            file_id = input_file.ID.replace(self.input_file_grp, self.output_file_grp)
-            if file_id == input_file.ID:
-                file_id = concat_padded(self.output_file_grp, n)
-            self.workspace.add_file(
-                ID=file_id,
-                file_grp=self.output_file_grp,
-                pageId=input_file.pageId,
-                mimetype=MIMETYPE_PAGE,
-                local_filename=os.path.join(self.output_file_grp,
-                                            file_id + '.xml'),
-                content=to_xml(pcgts))
+                                    '(merging)' if plausibilize else '')
+                        mark_for_merging[region1.id] = region2
+
+                # TODO: more merging cases...
+                #LOG.info('Intersection %i', poly1.intersects(poly2))
+                #LOG.info('Containment %i', poly1.contains(poly2))
+                #if poly1.intersects(poly2):
+                #    LOG.info('Area 1 %d', poly1.area)
+                #    LOG.info('Area 2 %d', poly2.area)
+                #    LOG.info('Area intersect %d', poly1.intersection(poly2).area)
+                    
+
+        if plausibilize:
+            # the reading order does not have to include all regions
+            # but it may include all types of regions!
+            ro = page.get_ReadingOrder()
+            if ro:
+                rogroup = ro.get_OrderedGroup() or ro.get_UnorderedGroup()
+            else:
+                rogroup = None
+            # pass the regions sorted (see above)
+            _plausibilize_group(regionspolys, rogroup, mark_for_deletion, mark_for_merging)
     
-    def sanitize_page(self, page, page_id):
+    @staticmethod
+    def sanitize_page(page, page_id, page_image, page_coords, use_gpu=False):
         regions = page.get_TextRegion()
-        page_image, page_coords, _ = self.workspace.image_from_page(
-            page, page_id)
+        # (allocate only once, and reset only the part
+        #  which is actually drawn and closed for each region)
+        page_mask = np.zeros((page_image.height, page_image.width), dtype=np.uint8)
         for region in regions:
             LOG.info('Sanitizing region "%s"', region.id)
             lines = region.get_TextLine()
@@ -192,18 +276,26 @@ class RepairSegmentation(Processor):
             heights = []
             tops = []
             # get labels:
-            region_mask = np.zeros((page_image.height, page_image.width), dtype=np.uint8)
-            for line in lines:
-                line_polygon = coordinates_of_segment(line, page_image, page_coords)
+            line_polygons = [coordinates_of_segment(line, page_image, page_coords)
+                             for line in lines]
+            # get bounding box of all lines (clipped to the page),
+            # plus 1px margin for the final dilation:
+            all_points = np.concatenate(line_polygons)
+            xmin, ymin = np.maximum(0, all_points.min(axis=0) - 1)
+            xmax, ymax = np.minimum((page_image.width - 1, page_image.height - 1),
+                                    all_points.max(axis=0) + 1)
+            if xmin > xmax or ymin > ymax:
+                LOG.warning('Zero contour area in region "%s"', region.id)
+                continue
+            region_mask = page_mask[ymin:ymax + 1, xmin:xmax + 1]
+            region_mask[...] = 0
+            for line_polygon in line_polygons:
                 line_xywh = xywh_from_polygon(line_polygon)
                 heights.append(line_xywh['h'])
                 tops.append(line_xywh['y'])
-                region_mask[draw.polygon(line_polygon[:, 1],
-                                         line_polygon[:, 0],
-                                         region_mask.shape)] = 1
-                region_mask[draw.polygon_perimeter(line_polygon[:, 1],
-                                                   line_polygon[:, 0],
-                                                   region_mask.shape)] = 1
+                line_points = (line_polygon - (xmin, ymin)).reshape(-1, 1, 2)
+                # (includes the outline, even for degenerate polygons)
+                cv2.fillPoly(region_mask, [line_points], 1)
             # estimate scale:
             heights = np.array(heights)
             scale = int(np.max(heights))
@@ -217,13 +309,24 @@ class RepairSegmentation(Processor):
                 deltas = tops[1:] - bottoms[:-1]
                 scale = max(scale, int(np.max(deltas)))
             # close labels:
+            # (dilate and erode separately instead of cv2.MORPH_CLOSE, because
+            #  even kernel heights need mirrored anchors for a proper closing;
+            #  the closing of the lines never exceeds their bounding box, so
+            #  it suffices to operate on the box instead of the full page)
+            kernel = np.ones((scale, 1), np.uint8)
             region_mask = np.pad(region_mask, scale) # protect edges
-            region_mask = np.array(morphology.binary_closing(region_mask, np.ones((scale, 1))), dtype=np.uint8)
-            region_mask = region_mask[scale:-scale, scale:-scale] # unprotect
-            # extend margins (to ensure simplified hull polygon is outside children):
-            region_mask = filters.maximum_filter(region_mask, 3) # 1px in each direction
+            if use_gpu:
+                # (also extend margins, see below, before downloading again)
+                region_mask = _close_extend_cuda(region_mask, kernel, scale)
+            else:
+                region_mask = cv2.dilate(region_mask, kernel, anchor=(0, scale // 2))
+                region_mask = cv2.erode(region_mask, kernel, anchor=(0, (scale - 1) // 2))
+                region_mask = region_mask[scale:-scale, scale:-scale] # unprotect
+                # extend margins (to ensure simplified hull polygon is outside children):
+                region_mask = cv2.dilate(region_mask, np.ones((3, 3), np.uint8)) # 1px in each direction
             # find outer contour (parts):
-            contours, _ = cv2.findContours(region_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            contours, _ = cv2.findContours(region_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE,
+                                           offset=(int(xmin), int(ymin)))
             # determine areas of parts:
             areas = [cv2.contourArea(contour) for contour in contours]
             total_area = sum(areas)
@@ -239,13 +342,19 @@ class RepairSegmentation(Processor):
                     LOG.warning('Ignoring contour %d too small (%d/%d) in region "%s"',
                                 i, area, total_area, region.id)
                     continue
-                # simplify shape:
-                # can produce invalid (self-intersecting) polygons:
-                #polygon = cv2.approxPolyDP(contour, 2, False)[:, 0, ::] # already ordered x,y
                 polygon = contour[:, 0, ::] # already ordered x,y
-                polygon = Polygon(polygon).simplify(1).exterior.coords
-                if len(polygon) < 4:
-                    LOG.warning('Ignoring contour %d less than 4 points in region "%s"',
+                if len(polygon) > 8:
+                    # simplify shape (unless already small):
+                    # try plain Douglas-Peucker first, but that
+                    # can produce invalid (self-intersecting) polygons,
+                    # so fall back to topology-preserving simplification:
+                    simplified = cv2.approxPolyDP(contour, 1, True)[:, 0, ::]
+                    if len(simplified) >= 3 and Polygon(simplified).is_valid:
+                        polygon = simplified
+                    else:
+                        polygon = np.array(Polygon(polygon).simplify(1).exterior.coords[:-1])
+                if len(polygon) < 3:
+                    LOG.warning('Ignoring contour %d less than 3 points in region "%s"',
                                 i, region.id)
                     continue
                 if region_polygon is not None:
@@ -256,9 +365,10 @@ class RepairSegmentation(Processor):
                 region_polygon = coordinates_for_segment(polygon, page_image, page_coords)
             if region_polygon is not None:
                 LOG.info('Using new coordinates for region "%s"', region.id)
-                region.get_Coords().points = points_from_polygon(region_polygon)
+                region.get_Coords().points = points_from_array(region_polygon)
     
-    def validate_coords(self, page, page_id):
+    @staticmethod
+    def validate_coords(page, page_id):
         valid = True
         regions = page.get_TextRegion()
         if page.get_Border():
@@ -275,63 +385,187 @@ class RepairSegmentation(Processor):
                 page.get_SeparatorRegion() +
                 page.get_TableRegion() +
                 page.get_UnknownRegion())
-            for region in regions + other_regions:
-                if not _child_within_parent(region, page.get_Border()):
+            border_poly = _segment_polygon(page.get_Border())
+            border_prep = _prep_valid(border_poly)
+            all_regions = regions + other_regions
+            for region, region_poly in zip(all_regions, _segment_polygons(all_regions)):
+                if not _within(region_poly, border_poly, border_prep):
                     LOG.warning('Region "%s" extends beyond Border of page "%s"',
                                 region.id, page_id)
                     valid = False
-        for region in regions:
+        # parse each polygon only once, and reuse it (prepared
+        # for repeated containment tests, if valid) as parent for its children
+        for region, region_poly in zip(regions, _segment_polygons(regions)):
+            region_prep = _prep_valid(region_poly)
             lines = region.get_TextLine()
-            for line in lines:
-                if not _child_within_parent(line, region):
+            for line, line_poly in zip(lines, _segment_polygons(lines)):
+                line_prep = _prep_valid(line_poly)
+                if not _within(line_poly, region_poly, region_prep):
                     LOG.warning('Line "%s" extends beyond region "%s" on page "%s"',
                                 line.id, region.id, page_id)
                     valid = False
                 if line.get_Baseline():
                     baseline = LineString(polygon_from_points(line.get_Baseline().points))
-                    linepoly = Polygon(polygon_from_points(line.get_Coords().points))
-                    if not baseline.within(linepoly):
+                    if not _within(baseline, line_poly, line_prep):
                         LOG.warning('Baseline extends beyond line "%s" in region "%s" on page "%s"',
                                     line.id, region.id, page_id)
                         valid = False
                 words = line.get_Word()
-                for word in words:
-                    if not _child_within_parent(word, line):
+                for word, word_poly in zip(words, _segment_polygons(words)):
+                    word_prep = _prep_valid(word_poly)
+                    if not _within(word_poly, line_poly, line_prep):
                         LOG.warning('Word "%s" extends beyond line "%s" in region "%s" on page "%s"',
                                     word.id, line.id, region.id, page_id)
                         valid = False
                     glyphs = word.get_Glyph()
-                    for glyph in glyphs:
-                        if not _child_within_parent(glyph, word):
+                    for glyph, glyph_poly in zip(glyphs, _segment_polygons(glyphs)):
+                        if not _within(glyph_poly, word_poly, word_prep):
                             LOG.warning('Glyph "%s" extends beyond word "%s" in line "%s" of region "%s" on page "%s"',
                                         glyph.id, word.id, line.id, region.id, page_id)
                             valid = False
         return valid
 
-def _child_within_parent(child, parent):
-    child_poly = Polygon(polygon_from_points(child.get_Coords().points))
-    parent_poly = Polygon(polygon_from_points(parent.get_Coords().points))
-    return child_poly.within(parent_poly)
+def _repair_page(page, page_id, page_image, page_coords, parameter):
+    """Validate, sanitize and plausibilize the segmentation of ``page`` in-place."""
+    #
+    # validate segmentation (warn of children extending beyond their parents)
+    #
+    RepairSegmentation.validate_coords(page, page_id)
+
+    #
+    # sanitize region segmentation (shrink to hull of lines)
+    #
+    if parameter['sanitize']:
+        RepairSegmentation.sanitize_page(page, page_id, page_image, page_coords,
+                                         parameter['use_gpu'])
+
+    #
+    # plausibilize region segmentation (remove redundant text regions)
+    #
+    RepairSegmentation.plausibilize_page(page, page_id, parameter['plausibilize'],
+                                         parameter['plausibilize_merge_min_overlap'])
+
+def _repair_page_xml(xml, page_id, page_image, page_coords, parameter):
+    """Like ``_repair_page``, but on serialized PAGE-XML (for worker processes)."""
+    pcgts = parseString(xml.encode('utf-8'), silence=True)
+    _repair_page(pcgts.get_Page(), page_id, page_image, page_coords, parameter)
+    return to_xml(pcgts)
+
+def _cuda_available():
+    try:
+        return (cv2.cuda.getCudaEnabledDeviceCount() > 0 and
+                hasattr(cv2.cuda, 'createMorphologyFilter'))
+    except (AttributeError, cv2.error):
+        # OpenCV built without CUDA support
+        return False
+
+def _close_extend_cuda(mask, kernel, scale):
+    """Close the padded ``mask`` with ``kernel``, dilate by 1px, and unpad (on the GPU).
+    
+    Same as the CPU variant in ``sanitize_page``, but keeps the mask on the
+    device for all morphological operations. (Because the closed mask is
+    empty within the padding, dilating before unpadding makes no difference.)
+    """
+    gpu_mask = cv2.cuda_GpuMat()
+    gpu_mask.upload(mask)
+    for op, kernel_, anchor in [
+            (cv2.MORPH_DILATE, kernel, (0, scale // 2)),
+            (cv2.MORPH_ERODE, kernel, (0, (scale - 1) // 2)),
+            (cv2.MORPH_DILATE, np.ones((3, 3), np.uint8), (-1, -1))]:
+        morph = cv2.cuda.createMorphologyFilter(op, cv2.CV_8UC1, kernel_, anchor)
+        gpu_mask = morph.apply(gpu_mask)
+    return gpu_mask.download()[scale:-scale, scale:-scale]
+
+def _segment_polygon(segment):
+    return _segment_polygons([segment])[0]
+
+def _segment_polygons(segments):
+    """Get the polygons of all ``segments``.
+    
+    Polygons are cached on the segments along with the points they were
+    parsed from, so each is built at most once unless its coordinates change.
+    Missing ones are built at once (in a single vectorized call with Shapely 2).
+    """
+    missing = [segment for segment in segments
+               if getattr(segment, '_polygon_cache', (None,))[0] != segment.get_Coords().points]
+    points = [polygon_from_points(segment.get_Coords().points)
+              for segment in missing]
+    if polygons is None or not points:
+        polys = [Polygon(coords) for coords in points]
+    else:
+        indices = np.repeat(np.arange(len(points)), [len(coords) for coords in points])
+        polys = polygons(linearrings(np.concatenate(points), indices=indices))
+    for segment, poly in zip(missing, polys):
+        segment._polygon_cache = (segment.get_Coords().points, poly)
+    return [segment._polygon_cache[1] for segment in segments]
+
+def _polygon_areas(polys):
+    """Get the areas of all ``polys`` (simple polygons without holes) as an array.
+    
+    (With Shapely 2, fetch all coordinates at once and apply the shoelace
+     formula in NumPy, instead of asking GEOS for each area separately.)
+    """
+    if get_coordinates is None or not polys:
+        return np.array([poly.area for poly in polys])
+    coords, indices = get_coordinates(polys, return_index=True)
+    # consecutive vertices of the same (closed) ring:
+    same = indices[:-1] == indices[1:]
+    cross = (coords[:-1, 0] * coords[1:, 1] -
+             coords[1:, 0] * coords[:-1, 1])
+    return 0.5 * np.abs(np.bincount(indices[:-1][same], weights=cross[same],
+                                    minlength=len(polys)))
+
+def _prep_valid(poly):
+    """Prepare ``poly`` for repeated predicates, unless it is invalid (then return None)."""
+    if poly.is_valid:
+        return prep(poly)
+    return None
+
+def _within(child, parent, parent_prep=None):
+    """Whether ``child`` is within ``parent``, using its prepared form ``parent_prep`` if given.
+    
+    (Prepared and plain predicates can disagree for invalid geometries, which
+     validation is meant to detect, so only use the former when both are valid.)
+    """
+    if parent_prep is not None and child.is_valid:
+        return parent_prep.contains(child)
+    return child.within(parent)
+
+def _bbox_almost_equal(bounds1, bounds2):
+    # same tolerance as Shapely's almost_equals (with default decimal=6)
+    return all(abs(coord1 - coord2) <= 0.5e-6
+               for coord1, coord2 in zip(bounds1, bounds2))
+
+def _bbox_within(inner, outer):
+    return (inner[0] >= outer[0] and inner[1] >= outer[1] and
+            inner[2] <= outer[2] and inner[3] <= outer[3])
+
+def _bbox_intersection_area(bounds1, bounds2):
+    minx1, miny1, maxx1, maxy1 = bounds1
+    minx2, miny2, maxx2, maxy2 = bounds2
+    width = min(maxx1, maxx2) - max(minx1, minx2)
+    height = min(maxy1, maxy2) - max(miny1, miny2)
+    return max(0, width) * max(0, height)
 
 def _plausibilize_group(regionspolys, rogroup, mark_for_deletion, mark_for_merging):
     wait_for_deletion = list()
     reading_order = dict()
-    regionrefs = list()
-    ordered = False
-    if isinstance(rogroup, (OrderedGroupType, OrderedGroupIndexedType)):
-        regionrefs = (rogroup.get_RegionRefIndexed() +
-                      rogroup.get_OrderedGroupIndexed() +
-                      rogroup.get_UnorderedGroupIndexed())
-        ordered = True
-    if isinstance(rogroup, (UnorderedGroupType, UnorderedGroupIndexedType)):
-        regionrefs = (rogroup.get_RegionRef() +
-                      rogroup.get_OrderedGroup() +
-                      rogroup.get_UnorderedGroup())
-    for elem in regionrefs:
-        reading_order[elem.get_regionRef()] = elem
-        if not isinstance(elem, (RegionRefType, RegionRefIndexedType)):
-            # recursive reading order element (un/ordered group):
-            _plausibilize_group(regionspolys, elem, mark_for_deletion, mark_for_merging)
+    removed_refs = set() # ids of reading order elements to remove
+    pending_merges = dict() # superregion id -> (superregion, polygons to merge into it)
+    changed_groups = dict() # groups to remove them from
+    # traverse the (possibly nested) reading order groups iteratively,
+    # keeping track of the group each element belongs to:
+    rogroups = list()
+    stack = [rogroup] if rogroup else []
+    while stack:
+        group = stack.pop()
+        rogroups.append(group)
+        for elem in _group_elements(group):
+            reading_order[elem.get_regionRef()] = (group, elem)
+            if not isinstance(elem, (RegionRefType, RegionRefIndexedType)):
+                # recursive reading order element (un/ordered group):
+                stack.append(elem)
+    has_ro = bool(reading_order) # skip lookups if there is no reading order at all
     for regionpoly in regionspolys:
         delete = regionpoly.region.id in mark_for_deletion
         merge = regionpoly.region.id in mark_for_merging
@@ -339,8 +573,8 @@ def _plausibilize_group(regionspolys, rogroup, mark_for_deletion, mark_for_mergi
             region = regionpoly.region
             poly = regionpoly.polygon
             if merge:
-                # merge region with super region:
-                superreg = mark_for_merging[region.id]
+                # merge region with (final) super region:
+                superreg = _merge_target(region, mark_for_merging)
                 # granularity will necessarily be lost here --
                 # this is not for workflows/processors that already
                 # provide good/correct segmentation and reading order
@@ -351,9 +585,7 @@ def _plausibilize_group(regionspolys, rogroup, mark_for_deletion, mark_for_mergi
                 # show warnings when granularity is lost; but there might
                 # be good reasons to do more here when we have better processors
                 # and use-cases in the future
-                superpoly = Polygon(polygon_from_points(superreg.get_Coords().points))
-                superpoly = superpoly.union(poly)
-                superreg.get_Coords().points = points_from_polygon(superpoly.exterior.coords)
+                pending_merges.setdefault(superreg.id, (superreg, list()))[1].append(poly)
                 # FIXME should we merge/mix attributes and features?
                 if region.get_orientation() != superreg.get_orientation():
                     LOG.warning('Merging region "%s" with orientation %f into "%s" with %f',
@@ -380,21 +612,65 @@ def _plausibilize_group(regionspolys, rogroup, mark_for_deletion, mark_for_mergi
                                 region.id, region.get_TextEquiv(), # FIXME needs repr...
                                 superreg.id, superreg.get_TextEquiv()) # ...to be informative
             wait_for_deletion.append(region)
-            if region.id in reading_order:
-                regionref = reading_order[region.id]
+            if has_ro and region.id in reading_order:
+                group, regionref = reading_order[region.id]
                 # TODO: re-assign regionref.continuation and regionref.type to other?
-                # could be any of the 6 types above:
-                regionrefs = rogroup.__getattribute__(regionref.__class__.__name__.replace('Type', ''))
-                # remove in-place
-                regionrefs.remove(regionref)
-
-    if ordered:
-        # re-index the reading order!
-        regionrefs.sort(key=RegionRefIndexedType.get_index)
-        for i, regionref in enumerate(regionrefs):
-            regionref.set_index(i)
-        
-    for region in wait_for_deletion:
-        if region.parent_object_:
-            # remove in-place
-            region.parent_object_.get_TextRegion().remove(region)
+                removed_refs.add(id(regionref))
+                changed_groups[id(group)] = group
+
+    # update each superregion only once, with all regions merged into it:
+    for superreg, polys in pending_merges.values():
+        # (cascaded union in one go instead of pairwise unions)
+        superpoly = unary_union([_segment_polygon(superreg)] + polys)
+        superreg.get_Coords().points = points_from_array(superpoly.exterior.coords)
+
+    # remove in-place, but filter each of the (up to 3) lists of
+    # a group only once (instead of a linear list.remove per element):
+    for group in changed_groups.values():
+        for regionrefs in _group_lists(group):
+            regionrefs[:] = [regionref for regionref in regionrefs
+                             if id(regionref) not in removed_refs]
+
+    for group in rogroups:
+        if isinstance(group, (OrderedGroupType, OrderedGroupIndexedType)):
+            # re-index the reading order (across all element types)!
+            regionrefs = sorted(_group_elements(group), key=RegionRefIndexedType.get_index)
+            for i, regionref in enumerate(regionrefs):
+                regionref.set_index(i)
+
+    # remove in-place, but filter each parent's list only once
+    # (instead of a linear list.remove per region):
+    deleted = set(id(region) for region in wait_for_deletion)
+    parents = dict((id(region.parent_object_), region.parent_object_)
+                   for region in wait_for_deletion
+                   if region.parent_object_)
+    for parent in parents.values():
+        regions = parent.get_TextRegion()
+        regions[:] = [region for region in regions
+                      if id(region) not in deleted]
+
+def _merge_target(region, mark_for_merging):
+    """Follow chains of merges (A into B, B into C) to the final superregion."""
+    seen = set([region.id])
+    superreg = mark_for_merging[region.id]
+    while superreg.id in mark_for_merging:
+        nextreg = mark_for_merging[superreg.id]
+        if nextreg.id in seen:
+            break # cycle
+        seen.add(superreg.id)
+        superreg = nextreg
+    return superreg
+
+def _group_lists(rogroup):
+    if isinstance(rogroup, (OrderedGroupType, OrderedGroupIndexedType)):
+        return [rogroup.get_RegionRefIndexed(),
+                rogroup.get_OrderedGroupIndexed(),
+                rogroup.get_UnorderedGroupIndexed()]
+    if isinstance(rogroup, (UnorderedGroupType, UnorderedGroupIndexedType)):
+        return [rogroup.get_RegionRef(),
+                rogroup.get_OrderedGroup(),
+                rogroup.get_UnorderedGroup()]
+    return []
+
+def _group_elements(rogroup):
+    return [elem for elems in _group_lists(rogroup) for elem in elems]
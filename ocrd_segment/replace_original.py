@@ -1,11 +1,12 @@
 from __future__ import absolute_import
 
 import os.path
+import numpy as np
 
 from ocrd_utils import (
     getLogger, concat_padded,
-    coordinates_of_segment,
-    points_from_polygon,
+    polygon_from_points,
+    transform_coordinates,
     MIMETYPE_PAGE
 )
 from ocrd_models.ocrd_page import (
@@ -18,6 +19,7 @@ from ocrd_modelfactory import page_from_file
 from ocrd import Processor
 
 from .config import OCRD_TOOL
+from .util import points_from_array
 
 TOOL = 'ocrd-segment-replace-original'
 LOG = getLogger('processor.ReplaceOriginal')
@@ -95,19 +97,16 @@ class ReplaceOriginal(Processor):
             page.set_imageFilename(file_path)
             # adjust all coordinates
             if adapt_coords:
-                for region in page.get_AllRegions():
-                    region_polygon = coordinates_of_segment(region, page_image, page_coords)
-                    region.get_Coords().points = points_from_polygon(region_polygon)
-                    if isinstance(region, TextRegionType):
-                        for line in region.get_TextLine():
-                            line_polygon = coordinates_of_segment(line, page_image, page_coords)
-                            line.get_Coords().points = points_from_polygon(line_polygon)
-                            for word in line.get_Word():
-                                word_polygon = coordinates_of_segment(word, page_image, page_coords)
-                                word.get_Coords().points = points_from_polygon(word_polygon)
-                                for glyph in word.get_Glyph():
-                                    glyph_polygon = coordinates_of_segment(glyph, page_image, page_coords)
-                                    glyph.get_Coords().points = points_from_polygon(glyph_polygon)
+                # collect segments level by level, then transform all at once
+                regions = page.get_AllRegions()
+                lines = [line for region in regions
+                         if isinstance(region, TextRegionType)
+                         for line in region.get_TextLine()]
+                words = [word for line in lines for word in line.get_Word()]
+                glyphs = [glyph for word in words for glyph in word.get_Glyph()]
+                segments = regions + lines + words + glyphs
+                for segment, polygon in zip(segments, _coordinates_of_segments(segments, page_coords)):
+                    segment.get_Coords().points = points_from_array(polygon)
             
             # update METS (add the PAGE file):
             file_path = os.path.join(page_grp, file_id + '.xml')
@@ -120,3 +119,18 @@ class ReplaceOriginal(Processor):
                 content=to_xml(pcgts))
             LOG.info('created file ID: %s, file_grp: %s, path: %s',
                      file_id, page_grp, out.local_filename)
+
+def _coordinates_of_segments(segments, parent_coords):
+    """Get the coordinates of all ``segments`` relative to the parent image.
+    
+    Like ``coordinates_of_segment``, but applies the affine transform of
+    ``parent_coords`` to all polygons in a single matrix multiplication.
+    """
+    polygons = [polygon_from_points(segment.get_Coords().points)
+                for segment in segments]
+    if not polygons:
+        return []
+    offsets = np.cumsum([len(polygon) for polygon in polygons])[:-1]
+    coords = transform_coordinates(np.concatenate(polygons), parent_coords['transform'])
+    coords = np.round(coords).astype(np.int32)
+    return np.split(coords, offsets)
@@ -0,0 +1,31 @@
+from __future__ import absolute_import
+
+import numpy as np
+from shapely.geometry.base import BaseGeometry
+from shapely.strtree import STRtree
+
+def polygon_index(polygons):
+    """Build a spatial index over a list of ``polygons``.
+    
+    Return a function which maps a geometry to the (ascending) indices
+    of all ``polygons`` whose bounding box intersects the geometry's.
+    """
+    if not polygons:
+        return lambda geom: []
+    tree = STRtree(polygons)
+    # Shapely 1 queries yield the indexed geometries themselves,
+    # Shapely 2 queries yield their indices
+    index = dict((id(poly), i) for i, poly in enumerate(polygons))
+    def query(geom):
+        return sorted(index[id(hit)] if isinstance(hit, BaseGeometry) else int(hit)
+                      for hit in tree.query(geom))
+    return query
+
+def points_from_array(polygon):
+    """Serialize a ``polygon`` (array or sequence of x,y pairs) as PAGE ``points``.
+    
+    Like ``ocrd_utils.points_from_polygon`` (truncating to integers), but
+    converts to Python ints in one go instead of formatting NumPy scalars.
+    """
+    return ' '.join('%d,%d' % tuple(point)
+                    for point in np.asarray(polygon, dtype=np.int64).tolist())